@@ -1,6 +1,9 @@
+from lxml import html
 from pytest import raises
+from requests import Response
 
 from twill import utils
+from twill.browser import TwillBrowser
 from twill.errors import TwillException
 
 
@@ -16,6 +19,11 @@ def test_make_boolean():
     assert not make_boolean('0')
     assert make_boolean('+')
     assert not make_boolean('-')
+    assert make_boolean('on')
+    assert not make_boolean('off')
+    assert make_boolean(' True ')
+    assert make_boolean('42')
+    assert not make_boolean('00')
     with raises(TwillException):
         make_boolean('no')
 
@@ -24,3 +32,136 @@ def test_trunc():
     trunc = utils.trunc
     assert trunc('hello, world!', 12) == 'hello, w ...'
     assert trunc('hello, world!', 13) == 'hello, world!'
+    assert trunc('hello, world!', 14) == 'hello, world!'
+    assert trunc('', 12) == ''
+    assert trunc(None, 12) is None
+
+
+def test_split_value_prefix():
+    split_value_prefix = utils._split_value_prefix
+    assert split_value_prefix('value') == (True, 'value')
+    assert split_value_prefix('+value') == (True, 'value')
+    assert split_value_prefix('-value') == (False, 'value')
+    assert split_value_prefix('') == (True, '')
+
+
+def test_unique_match():
+    unique_match = utils.unique_match
+    form = html.fromstring(
+        '<form><input type="checkbox" name="a" value="1">'
+        '<input type="hidden" name="a" value="0">'
+        '<input type="submit" name="b" value="go">'
+        '<input type="submit" name="b" value="go">'
+        '<input type="submit" name="b" value="stop">'
+        '<input type="text" name="c"><input type="text" name="c"></form>')
+    a, b, c = ([i for i in form.inputs if i.name == name] for name in 'abc')
+    assert unique_match(c[:1])
+    assert unique_match(a)
+    assert unique_match(b[:2])
+    assert not unique_match(b)
+    assert not unique_match(c)
+
+
+def test_singleton():
+
+    class A(utils.Singleton):
+        pass
+
+    class B(A):
+        pass
+
+    a = A()
+    assert A() is a
+    b = B()
+    assert b is not a
+    assert B() is b
+    assert A() is a
+    A.reset()
+    assert A() is not a
+    assert B() is b
+
+
+def make_response(content, encoding=None):
+    response = Response()
+    response._content = content
+    response.encoding = encoding
+    response.url = 'http://localhost/'
+    return response
+
+
+def test_parse_with_encoding():
+    page = u'<html><head><title>Gr\xfc\xdfe</title></head></html>'
+    result = utils.ResultWrapper(
+        make_response(page.encode('iso-8859-1'), 'iso-8859-1'))
+    assert result.title == u'Gr\xfc\xdfe'
+
+
+def test_parse_without_encoding():
+    page = (u'<html><head><title>Gr\xfc\xdfe \u20ac</title></head>'
+            u'<body><p>Umlaute: \xe4\xf6\xfc \xc4\xd6\xdc \xdf</p>'
+            u'<a href="/\xe4">\xf6</a></body></html>')
+    result = utils.ResultWrapper(make_response(page.encode('utf-8')))
+    assert result.encoding is None
+    assert result.title == u'Gr\xfc\xdfe \u20ac'
+    assert result.links == [(u'\xf6', u'/\xe4')]
+
+
+def test_parse_with_unknown_encoding():
+    result = utils.ResultWrapper(make_response(
+        b'<html><head><title>Hello</title></head></html>', 'utf-8-sig'))
+    assert result.title == 'Hello'
+
+
+def test_parse_with_invalid_byte():
+    result = utils.ResultWrapper(make_response(
+        b'<html><body><a href="/a">A \xfc</a></body></html>', 'utf-8'))
+    assert result.links == [(u'A \ufffd', '/a')]
+    assert result.find_link('A') == (u'A \ufffd', '/a')
+
+
+def test_parse_with_mismatched_encoding():
+    page = (u'<html><head><title>Gr\xfc\xdfe</title></head><body>'
+            u'<a href="/a">A</a><form><input name="x"></form>'
+            u'</body></html>')
+    result = utils.ResultWrapper(make_response(page.encode('utf-8'), 'ascii'))
+    assert result.title == u'Gr\ufffd\ufffd\ufffd\ufffde'
+    assert result.links == [('A', '/a')]
+    assert len(result.forms) == 1
+
+
+def test_parse_with_xml_declaration():
+    page = (u'<?xml version="1.0" encoding="utf-8"?>'
+            u'<html><head><title>Gr\xfc\xdfe</title></head></html>')
+    result = utils.ResultWrapper(make_response(page.encode('utf-8'), 'utf-8'))
+    assert result.title == u'Gr\xfc\xdfe'
+
+
+def test_set_select_value_in_optgroup():
+    select = html.fromstring(
+        '<form><select name="s"><!-- numbers --><optgroup label="Numbers">'
+        '<option value="1">One</option><option value="2">Two</option>'
+        '</optgroup></select></form>').inputs['s']
+    utils.set_form_control_value(select, '2')
+    assert select.value == '2'
+    utils.set_form_control_value(select, 'One')
+    assert select.value == '1'
+    with raises(TwillException):
+        utils.set_form_control_value(select, 'Three')
+
+
+def test_links_are_not_shared():
+    result = utils.ResultWrapper(make_response(
+        b'<html><body><a href="/a">A</a></body></html>', 'utf-8'))
+    links = result.links
+    assert links == [('A', '/a')]
+    del links[:]
+    assert result.links == [('A', '/a')]
+
+
+def test_meta_refresh_after_invalid_byte():
+    result = utils.ResultWrapper(make_response(
+        b'<html><head><title>Gr\xc3\xbc\xc3\x9fe</title>'
+        b'<meta http-equiv="refresh" content="1; url=/next">'
+        b'</head></html>', 'ascii'))
+    assert TwillBrowser._get_meta_refresh(result) == (
+        1, 'http://localhost/next')
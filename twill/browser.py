@@ -15,7 +15,8 @@ from requests.packages.urllib3.exceptions import InsecureRequestWarning
 
 from . import log, __version__
 from .utils import (
-    print_form, trunc, unique_match, ResultWrapper, _equiv_refresh_interval)
+    print_form, trunc, unique_match, ResultWrapper,
+    _equiv_refresh_interval, _name_regex)
 from .errors import TwillException
 
 requests.packages.urllib3.disable_warnings(InsecureRequestWarning)
@@ -268,9 +269,8 @@ class TwillBrowser(object):
         if not isinstance(fieldname, int):
 
             # test regex match
-            regex = re.compile(fieldname)
-            match_name = [c for c in inputs
-                          if c.name and regex.search(c.name)]
+            search = _name_regex(fieldname).search
+            match_name = [c for c in inputs if c.name and search(c.name)]
             if match_name:
                 if unique_match(match_name):
                     return match_name[0]
@@ -431,11 +431,10 @@ class TwillBrowser(object):
         return new_payload
 
     @staticmethod
-    def _get_meta_refresh(response):
-        """Get meta refresh interval and url from a response."""
-        tree = html.fromstring(response.text)
+    def _get_meta_refresh(result):
+        """Get meta refresh interval and url from a result page."""
         try:
-            content = tree.xpath(  # "refresh" is case insensitive
+            content = result.xpath(  # "refresh" is case insensitive
                 "//meta[translate(@http-equiv,'REFSH','refsh')="
                 "'refresh'][1]/@content")[0]
             interval, url = content.split(';', 1)
@@ -451,7 +450,7 @@ class TwillBrowser(object):
             interval = url = None
         else:
             if '://' not in url:  # relative URL, adapt
-                url = urljoin(response.url, url)
+                url = urljoin(result.url, url)
         return interval, url
 
     _re_basic_auth = re.compile('Basic realm="(.*)"', re.I)
@@ -502,12 +501,15 @@ class TwillBrowser(object):
                 if auth:
                     r = self._session.get(url, auth=auth, verify=self.verify)
 
+        # parse the page only once and use it for the meta refresh check too
+        result = ResultWrapper(r)
+
         # handle redirection via meta refresh (not handled in requests)
         refresh_interval = _equiv_refresh_interval()
         if refresh_interval:
             visited = set()  # break circular refresh chains
             while True:
-                interval, url = self._get_meta_refresh(r)
+                interval, url = self._get_meta_refresh(result)
                 if not url:
                     break
                 if interval >= refresh_interval:
@@ -519,15 +521,15 @@ class TwillBrowser(object):
                     break
                 (log.info if self.show_refresh else log.debug)(
                     'Meta refresh to new URL: %s', url)
-                r = self._session.get(url)
+                result = ResultWrapper(self._session.get(url))
                 visited.add(url)
 
         if func_name in ('follow_link', 'open'):
             # If we're really reloading and just didn't say so, don't store
-            if self.result is not None and self.result.url != r.url:
+            if self.result is not None and self.result.url != result.url:
                 self._history.append(self.result)
 
-        self.result = ResultWrapper(r)
+        self.result = result
 
 
 browser = TwillBrowser()  # the global twill browser instance
@@ -9,29 +9,66 @@ import os
 import re
 
 from collections import namedtuple
+from copy import deepcopy
 
-from lxml import html
-
-try:
-    import tidylib
-except (ImportError, OSError):
-    # ImportError can be raised when PyTidyLib package is not installed
-    # OSError can be raised when the HTML Tidy shared library is not installed
-    tidylib = None
+from lxml import etree, html
 
 from . import log, twill_ext
 from .errors import TwillException
 
+try:
+    from functools import lru_cache
+except ImportError:  # Python 2
+    def lru_cache(maxsize=128):
+        return lambda func: func
+
+try:
+    from functools import cached_property
+except ImportError:  # Python < 3.8
+    class cached_property(object):
+        """A property that is computed only once per instance."""
+
+        def __init__(self, func):
+            self.func = func
+            self.__doc__ = func.__doc__
+
+        def __get__(self, instance, owner=None):
+            if instance is None:
+                return self
+            value = instance.__dict__[self.func.__name__] = self.func(instance)
+            return value
+
 
 Link = namedtuple('Link', 'text, url')
 
+# compiled XPath expressions used for every page that is loaded
+_title_xpath = etree.XPath('//title[1]/text()')
+_links_xpath = etree.XPath('//a[@href]')
+_orphans_xpath = etree.XPath('//input[not(ancestor::form)]')
+_submit_buttons_xpath = etree.XPath("//button[@type='submit']")
+
+
+@lru_cache(maxsize=128)
+def _name_regex(pattern):
+    """Get the compiled regular expression for a name pattern."""
+    return re.compile(pattern)
+
+
+@lru_cache(maxsize=16)
+def _html_parser(encoding):
+    """Get a reusable HTML parser for documents with the given encoding."""
+    return html.HTMLParser(encoding=encoding)
+
 
 class Singleton(object):
     """A mixin class to create singleton objects."""
 
+    __it__ = None
+
     def __new__(cls, *args, **kwargs):
-        it = cls.__dict__.get('__it__')
-        if it is not None:
+        it = cls.__it__
+        # the instance may have been inherited from a base class
+        if it is not None and it.__class__ is cls:
             return it
         cls.__it__ = it = object.__new__(cls)
         return it
@@ -49,7 +86,7 @@ class ResultWrapper(object):
     def __init__(self, response):
         self.response = response
         self.encoding = response.encoding
-        self.tree = html.fromstring(self.text)
+        self.tree = self._parse()
         self.xpath = self.tree.xpath
         self._fix_forms()
 
@@ -78,28 +115,61 @@ class ResultWrapper(object):
         """Get the headers of the result page."""
         return self.response.headers
 
-    @property
+    @cached_property
     def title(self):
         """Get the title of the result page."""
         try:
-            return self.xpath('//title[1]/text()')[0]
+            return _title_xpath(self.tree)[0]
         except IndexError:
             return None
 
+    @cached_property
+    def _links(self):
+        """Get all links in the result page as a tuple."""
+        return tuple(Link(a.text_content(), a.get('href'))
+                     for a in _links_xpath(self.tree))
+
     @property
     def links(self):
         """Get all links in the result page."""
-        return [Link(a.text_content(), a.get('href'))
-                for a in self.xpath('//a[@href]')]
+        # return a new list, so that callers cannot change the cached links
+        return list(self._links)
 
     def find_link(self, pattern):
         """Find a link with a given pattern on the result page."""
-        regex = re.compile(pattern)
-        for link in self.links:
-            if regex.search(link.text) or regex.search(link.url):
-                return link
+        search = _name_regex(pattern).search
+        for a in _links_xpath(self.tree):
+            # check the cheap href attribute before collecting the text
+            url = a.get('href')
+            if search(url):
+                return Link(a.text_content(), url)
+            text = a.text_content()
+            if search(text):
+                return Link(text, url)
         return None
 
+    def _parse(self):
+        """Parse the result page into an lxml tree.
+
+        The raw content is passed to lxml with the encoding that has been
+        reported by the server, but only if it is valid in that encoding,
+        since lxml stops parsing or produces broken text at invalid bytes.
+        Otherwise, the text decoded by requests is parsed, which has the
+        invalid bytes replaced, or uses the detected encoding if the server
+        did not report one.
+        """
+        encoding = self.encoding
+        if encoding:
+            content = self.content
+            try:
+                content.decode(encoding)
+                parser = _html_parser(encoding)
+            except (LookupError, UnicodeDecodeError):
+                pass
+            else:
+                return html.fromstring(content, parser=parser)
+        return html.fromstring(self.text)
+
     def form(self, formname=1):
         """Get the form with the given name on the result page"""
         forms = self.forms
@@ -113,10 +183,10 @@ class ResultWrapper(object):
                     return form
 
             # next, try regex with name
-            regex = re.compile(formname)
+            search = _name_regex(formname).search
             for form in forms:
                 name = form.get('name')
-                if name and regex.search(name):
+                if name and search(name):
                     return form
 
         # last, try number
@@ -132,21 +202,19 @@ class ResultWrapper(object):
     def _fix_forms(self):
         """Fix forms on the page for use with twill."""
         # put all stray fields into a form
-        orphans = self.xpath('//input[not(ancestor::form)]')
+        orphans = _orphans_xpath(self.tree)
         if orphans:
-            form = [b'<form>']
-            for orphan in orphans:
-                form.append(html.tostring(orphan))
-            form.append(b'</form>')
-            form = b''.join(form)
-            self.forms = html.fromstring(form).forms
+            # build the form from copies, leaving the page tree untouched
+            form = html.Element('form')
+            form.extend(map(deepcopy, orphans))
+            self.forms = [form]
             self.forms.extend(self.tree.forms)
         else:
             self.forms = self.tree.forms
         # convert all submit button elements to input elements, since
         # otherwise lxml will not recognize them as form input fields
         for form in self.forms:
-            for button in form.xpath("//button[@type='submit']"):
+            for button in _submit_buttons_xpath(form):
                 button.tag = 'input'
 
 
@@ -156,12 +224,16 @@ def trunc(s, length):
     The string is truncated by cutting off the last (length-4) characters
     and replacing them with ' ...'
     """
-    if s and len(s) > length:
+    # the slice is only non-empty if the string is longer than length
+    if s and s[length:length + 1]:
         return s[:length - 4] + ' ...'
     else:
         return s
 
 
+_form_field_format = '%-2s %-24s %-9s %-12s %s'
+
+
 def print_form(form, n):
     """Pretty-print the given form, with the assigned number."""
     info = log.info
@@ -177,33 +249,36 @@ def print_form(form, n):
 
         for n, field in enumerate(form.inputs, 1):
             value = field.value
-            if hasattr(field, 'value_options'):
-                items = ', '.join("'%s'" % (
-                    opt.name if hasattr(opt, 'name') else opt,)
-                    for opt in field.value_options)
+            value_options = getattr(field, 'value_options', None)
+            if value_options is not None:
+                items = ', '.join("'%s'" % (getattr(opt, 'name', opt),)
+                                  for opt in value_options)
                 value_displayed = '%s of %s' % (value, items)
             else:
                 value_displayed = '%s' % (value,)
             field_name = field.name
-            field_type = field.type if hasattr(field, 'type') else 'select'
+            field_type = getattr(field, 'type', 'select')
             field_id = field.get('id')
-            strings = (
-                '%-2s' % (n,),
-                '%-24s %-9s' % (
-                    trunc(field_name, 24), trunc(field_type, 9)),
-                '%-12s' % (trunc(field_id, 12),),
-                trunc(value_displayed, 40))
-            info(' '.join(strings))
+            info(_form_field_format, n,
+                 trunc(field_name, 24), trunc(field_type, 9),
+                 trunc(field_id, 12), trunc(value_displayed, 40))
     info('')
 
 
+_boolean_values = {
+    'true': True, 'false': False, '+': True, '-': False,
+    'on': True, 'off': False, '1': True, '0': False}
+
+
 def make_boolean(value):
     """Convert the input value into a boolean."""
     value = str(value).lower().strip()
 
-    # true/false
-    if value in ('true', 'false'):
-        return value == 'true'
+    # true/false, +/-, on/off, 1/0
+    try:
+        return _boolean_values[value]
+    except KeyError:
+        pass
 
     # 0/nonzero
     try:
@@ -213,14 +288,6 @@ def make_boolean(value):
     else:
         return bool(ival)
 
-    # +/-
-    if value in ('+', '-'):
-        return value == '+'
-
-    # on/off
-    if value in ('on', 'off'):
-        return value == 'on'
-
     raise TwillException("unable to convert '%s' into true/false" % (value,))
 
 
@@ -236,6 +303,18 @@ def make_int(value):
     raise TwillException("unable to convert '%s' into an int" % (value,))
 
 
+_value_prefixes = {'+': (True, 1), '-': (False, 1)}
+
+
+def _split_value_prefix(value):
+    """Split off a leading '+' (add) or '-' (remove) from a value.
+
+    Return a 2-tuple (add, value) where add is False for '-' only.
+    """
+    add, cut = _value_prefixes.get(value[:1], (True, 0))
+    return add, value[cut:]
+
+
 def set_form_control_value(control, value):
     """Set the given control to the given value
 
@@ -258,34 +337,26 @@ def set_form_control_value(control, value):
         control.value = value
 
     elif isinstance(control, html.CheckboxGroup):
-        if value.startswith('-'):
-            value = value[1:]
+        add, value = _split_value_prefix(value)
+        if add:
+            control.value.add(value)
+        else:
             try:
                 control.value.remove(value)
             except KeyError:
                 pass
-        else:
-            if value.startswith('+'):
-                value = value[1:]
-            control.value.add(value)
 
     elif isinstance(control, html.SelectElement):
         # for ListControls we need to find the right *value*,
         # and figure out if we want to *select* or *deselect*
-        if value.startswith('-'):
-            add = False
-            value = value[1:]
-        else:
-            add = True
-            if value.startswith('+'):
-                value = value[1:]
+        add, value = _split_value_prefix(value)
 
         # now, select the value.
-        options = [opt.strip() for opt in control.value_options]
-        option_names = [(c.text or '').strip() for c in control.getchildren()]
-        full_options = dict(zip(option_names, options))
-        for name, opt in full_options.items():
-            if value not in (name, opt):
+        # pair the values with the option elements, which can be nested
+        # inside optgroup elements instead of being direct children
+        for opt, option in zip(control.value_options, control.iter('option')):
+            opt = opt.strip()
+            if value != opt and value != (option.text or '').strip():
                 continue
             if isinstance(control.value, html.MultipleSelectOptions):
                 if add:
@@ -305,23 +376,23 @@ def set_form_control_value(control, value):
         raise TwillException('Attempt to set value on invalid control')
 
 
+_submit_types = frozenset(('submit', 'hidden'))
+_checkbox_types = frozenset(('checkbox', 'hidden'))
+
+
 def _all_the_same_submit(matches):
     """Check if a list of controls all belong to the same control.
 
     For use with checkboxes, hidden, and submit buttons.
     """
-    name = value = None
-    for match in matches:
-        if not isinstance(match, html.InputElement):
-            return False
-        if match.type not in ('submit', 'hidden'):
-            return False
-        if name is None:
-            name = match.name
-            value = match.value
-        elif match.name != name or match.value != value:
-            return False
-    return True
+    if not matches:
+        return True
+    name, value = matches[0].name, matches[0].value
+    return all(
+        isinstance(match, html.InputElement) and
+        match.type in _submit_types and
+        match.name == name and match.value == value
+        for match in matches)
 
 
 def _all_the_same_checkbox(matches):
@@ -332,18 +403,13 @@ def _all_the_same_checkbox(matches):
     does not check the checkbox. Without the hidden control, no
     value would be returned.
     """
-    name = None
-    for match in matches:
-        if not isinstance(match, html.InputElement):
-            return False
-        if match.type not in ('checkbox', 'hidden'):
-            return False
-        if name is None:
-            name = match.name
-        else:
-            if match.name != name:
-                return False
-    return True
+    if not matches:
+        return True
+    name = matches[0].name
+    return all(
+        isinstance(match, html.InputElement) and
+        match.type in _checkbox_types and match.name == name
+        for match in matches)
 
 
 def unique_match(matches):
@@ -352,14 +418,48 @@ def unique_match(matches):
             _all_the_same_checkbox(matches) or _all_the_same_submit(matches))
 
 
+_options = None
+
+
+def _get_option(name):
+    """Get the value of the given twill option.
+
+    The options live in the commands module, which cannot be imported when
+    loading this module, since it imports this module itself.
+    """
+    global _options
+    if _options is None:
+        from .commands import options
+        _options = options
+    return _options.get(name)
+
+
+tidylib = False  # PyTidyLib is imported when run_tidy() is first called
+
+
+def _import_tidylib():
+    """Import PyTidyLib, return None if it is not available."""
+    try:
+        import tidylib
+    except (ImportError, OSError):
+        # ImportError can be raised when PyTidyLib package is not installed
+        # OSError can be raised when the HTML Tidy shared library
+        # is not installed
+        tidylib = None
+    return tidylib
+
+
 def run_tidy(html):
     """Run HTML Tidy on the given HTML string.
 
     Return a 2-tuple (output, errors).  (None, None) will be returned if
     PyTidyLib (or the required shared library for tidy) isn't installed.
     """
-    from .commands import options
-    require_tidy = options.get('require_tidy')
+    global tidylib
+    if tidylib is False:
+        tidylib = _import_tidylib()
+
+    require_tidy = _get_option('require_tidy')
 
     if not tidylib:
         if require_tidy:
@@ -376,8 +476,7 @@ def _equiv_refresh_interval():
 
     Redirection happens if the given interval is smaller than this.
     """
-    from .commands import options
-    return options.get('equiv_refresh_interval')
+    return _get_option('equiv_refresh_interval')
 
 
 def is_hidden_filename(filename):
@@ -408,14 +507,15 @@ def gather_filenames(arglist):
     for arg in arglist:
         name = make_twill_filename(arg)
         if os.path.isdir(name):
-            for dirpath, dirnames, filenames in os.walk(arg):
+            filenames_in_dir = []
+            for dirpath, dirnames, filenames in os.walk(name):
+                # prune hidden directories such as .git before descending
                 dirnames[:] = [
                     d for d in dirnames if not is_hidden_filename(d)]
-                for filename in filenames:
-                    if not is_twill_filename(filename):
-                        continue
-                    filename = os.path.join(dirpath, filename)
-                    names.append(filename)
+                filenames_in_dir.extend(
+                    os.path.join(dirpath, filename) for filename in filenames
+                    if is_twill_filename(filename))
+            names.extend(sorted(filenames_in_dir))
         else:
             names.append(name)
     return names